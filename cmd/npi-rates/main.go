@@ -51,6 +51,8 @@ func newSearchCmd() *cobra.Command {
 		providerName string
 		state        string
 		outputFile   string
+		outputFormat string
+		pretty       bool
 		workers      int
 		tmpDir       string
 		noProgress   bool
@@ -66,7 +68,9 @@ func newSearchCmd() *cobra.Command {
 		// Cloud mode flags (Modal orchestration)
 		cloudMode    bool
 		shards       int
+		minPerShard  int
 		cloudWorkers int
+		concurrency  int
 	)
 
 	cmd := &cobra.Command{
@@ -76,6 +80,15 @@ func newSearchCmd() *cobra.Command {
 			if noSimd {
 				mrf.DisableSimd()
 			}
+			if outputFormat != output.FormatJSON && outputFormat != output.FormatJSONL {
+				return fmt.Errorf("--format must be %q or %q", output.FormatJSON, output.FormatJSONL)
+			}
+			if outputFormat != output.FormatJSON && cloudMode {
+				return fmt.Errorf("--format %s is not supported in cloud mode", outputFormat)
+			}
+			if outputFormat == output.FormatJSONL && pretty {
+				return fmt.Errorf("--pretty cannot be combined with --format jsonl")
+			}
 
 			// Resolve NPIs — either from --npi or --provider-name
 			var npis []int64
@@ -178,8 +191,11 @@ func newSearchCmd() *cobra.Command {
 					URLsFile:        urlsFile,
 					URLs:            urlsList,
 					OutputFile:      outputFile,
+					Pretty:          pretty,
 					Shards:          shards,
+					MinURLsPerShard: minPerShard,
 					WorkersPerShard: cloudWorkers,
+					Concurrency:     concurrency,
 				})
 			}
 
@@ -265,7 +281,14 @@ func newSearchCmd() *cobra.Command {
 				DurationSeconds: duration.Seconds(),
 			}
 
-			if err := output.WriteResults(outputFile, params, allRates); err != nil {
+			writeResults := output.WriteResults
+			switch {
+			case outputFormat == output.FormatJSONL:
+				writeResults = output.WriteResultsJSONL
+			case pretty:
+				writeResults = output.WriteResultsIndented
+			}
+			if err := writeResults(outputFile, params, allRates); err != nil {
 				return fmt.Errorf("writing output: %w", err)
 			}
 
@@ -284,6 +307,8 @@ func newSearchCmd() *cobra.Command {
 	cmd.Flags().StringVar(&providerName, "provider-name", "", "Search by provider name (\"First Last\")")
 	cmd.Flags().StringVar(&state, "state", "", "State filter for provider name search (2-letter code, e.g. NY)")
 	cmd.Flags().StringVarP(&outputFile, "output", "o", "", "Output file path (default: results_<timestamp>.json, use '-' for stdout)")
+	cmd.Flags().StringVar(&outputFormat, "format", output.FormatJSON, "Output format: json, or jsonl (search_params header line, then one rate per line) (local only)")
+	cmd.Flags().BoolVar(&pretty, "pretty", false, "Indent JSON output for readability (default: compact)")
 	cmd.Flags().IntVar(&workers, "workers", 3, "Number of concurrent file workers")
 	cmd.Flags().StringVar(&tmpDir, "tmp-dir", "", "Temp directory for intermediate files (default: system temp)")
 	cmd.Flags().BoolVar(&noProgress, "no-progress", false, "Disable progress bars")
@@ -298,8 +323,10 @@ func newSearchCmd() *cobra.Command {
 
 	// Cloud mode flags (Modal orchestration)
 	cmd.Flags().BoolVar(&cloudMode, "cloud", false, "Run in cloud mode (distribute to Modal functions)")
-	cmd.Flags().IntVar(&shards, "shards", 100, "Number of URL shards (cloud mode)")
-	cmd.Flags().IntVar(&cloudWorkers, "cloud-workers", 1, "Workers per shard (cloud mode)")
+	cmd.Flags().IntVar(&shards, "shards", 400, "Maximum number of URL shards (cloud mode)")
+	cmd.Flags().IntVar(&minPerShard, "min-urls-per-shard", 16, "Minimum URLs per shard; caps the shard count for short lists (cloud mode)")
+	cmd.Flags().IntVar(&concurrency, "concurrency", 20, "Maximum shard containers running at once (cloud mode)")
+	cmd.Flags().IntVar(&cloudWorkers, "cloud-workers", 0, "Workers per shard (cloud mode, 0 = one per container CPU)")
 
 	return cmd
 }
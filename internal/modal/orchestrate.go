@@ -20,8 +20,11 @@ type Config struct {
 	URLsFile        string   // path to URLs file (already exists on disk)
 	URLs            []string // if set, written to temp file
 	OutputFile      string
-	Shards          int
-	WorkersPerShard int
+	Pretty          bool
+	Shards          int // upper bound; capped so each shard gets MinURLsPerShard URLs
+	MinURLsPerShard int
+	WorkersPerShard int // 0 means one worker per container CPU
+	Concurrency     int // maximum number of shard containers running at once
 }
 
 // RunSearch executes a distributed search by shelling out to `modal run python/deploy_modal.py`.
@@ -58,11 +61,16 @@ func RunSearch(ctx context.Context, cfg Config) error {
 		"--npi", cfg.NPI,
 		"--urls-file", urlsFile,
 		"--shards", strconv.Itoa(cfg.Shards),
+		"--min-urls-per-shard", strconv.Itoa(cfg.MinURLsPerShard),
+		"--concurrency", strconv.Itoa(cfg.Concurrency),
 		"--workers", strconv.Itoa(cfg.WorkersPerShard),
 	}
 	if cfg.OutputFile != "" {
 		args = append(args, "--output", cfg.OutputFile)
 	}
+	if cfg.Pretty {
+		args = append(args, "--pretty")
+	}
 
 	logf("Running: modal %s", strings.Join(args, " "))
 	start := time.Now()
@@ -1,15 +1,32 @@
 package output
 
 import (
+	"bufio"
 	"encoding/json"
 	"fmt"
+	"io"
 	"os"
 
 	"github.com/gyeh/npi-rates/internal/mrf"
 )
 
-// WriteResults writes the final JSON output to the specified file.
+// Output formats accepted by the search command's --format flag.
+const (
+	FormatJSON  = "json"
+	FormatJSONL = "jsonl"
+)
+
+// WriteResults writes the final output as compact JSON to the specified file.
 func WriteResults(outputPath string, params mrf.SearchParams, results []mrf.RateResult) error {
+	return writeJSON(outputPath, params, results, false)
+}
+
+// WriteResultsIndented writes the final output as human-readable, indented JSON.
+func WriteResultsIndented(outputPath string, params mrf.SearchParams, results []mrf.RateResult) error {
+	return writeJSON(outputPath, params, results, true)
+}
+
+func writeJSON(outputPath string, params mrf.SearchParams, results []mrf.RateResult, indent bool) error {
 	if results == nil {
 		results = []mrf.RateResult{}
 	}
@@ -19,7 +36,13 @@ func WriteResults(outputPath string, params mrf.SearchParams, results []mrf.Rate
 		Results:      results,
 	}
 
-	data, err := json.MarshalIndent(output, "", "  ")
+	var data []byte
+	var err error
+	if indent {
+		data, err = json.MarshalIndent(output, "", "  ")
+	} else {
+		data, err = json.Marshal(output)
+	}
 	if err != nil {
 		return fmt.Errorf("marshaling output: %w", err)
 	}
@@ -32,3 +55,42 @@ func WriteResults(outputPath string, params mrf.SearchParams, results []mrf.Rate
 
 	return os.WriteFile(outputPath, data, 0o644)
 }
+
+// WriteResultsJSONL writes the output as JSON Lines: a {"search_params": ...}
+// header line followed by one rate per line. encoding/json never emits raw
+// newlines inside a value, so consumers can splice the rate lines into a JSON
+// array without decoding them.
+func WriteResultsJSONL(outputPath string, params mrf.SearchParams, results []mrf.RateResult) error {
+	if outputPath == "-" {
+		return writeJSONL(os.Stdout, params, results)
+	}
+
+	f, err := os.Create(outputPath)
+	if err != nil {
+		return fmt.Errorf("creating output: %w", err)
+	}
+	if err := writeJSONL(f, params, results); err != nil {
+		f.Close()
+		return err
+	}
+	return f.Close()
+}
+
+func writeJSONL(w io.Writer, params mrf.SearchParams, results []mrf.RateResult) error {
+	bw := bufio.NewWriter(w)
+	enc := json.NewEncoder(bw)
+
+	header := struct {
+		SearchParams mrf.SearchParams `json:"search_params"`
+	}{params}
+	if err := enc.Encode(header); err != nil {
+		return fmt.Errorf("marshaling search params: %w", err)
+	}
+	for i := range results {
+		if err := enc.Encode(&results[i]); err != nil {
+			return fmt.Errorf("marshaling result: %w", err)
+		}
+	}
+
+	return bw.Flush()
+}
@@ -0,0 +1,69 @@
+package output
+
+import (
+	"bytes"
+	"encoding/json"
+	"os"
+	"path/filepath"
+	"testing"
+
+	"github.com/gyeh/npi-rates/internal/mrf"
+)
+
+func TestWriteResultsJSONL(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "results.jsonl")
+	params := mrf.SearchParams{NPIs: []int64{1770671182}, SearchedFiles: 2, MatchedFiles: 1}
+	results := []mrf.RateResult{
+		{SourceFile: "a.json.gz", NPI: 1770671182, BillingCode: "99213", BillingCodeDescription: "line one\nline two"},
+		{SourceFile: "a.json.gz", NPI: 1770671182, BillingCode: "99214"},
+	}
+
+	if err := WriteResultsJSONL(path, params, results); err != nil {
+		t.Fatalf("WriteResultsJSONL failed: %v", err)
+	}
+	data, err := os.ReadFile(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+
+	lines := bytes.Split(bytes.TrimSuffix(data, []byte("\n")), []byte("\n"))
+	if len(lines) != 3 {
+		t.Fatalf("expected 3 lines (header + 2 rates), got %d", len(lines))
+	}
+
+	var header struct {
+		SearchParams mrf.SearchParams `json:"search_params"`
+	}
+	if err := json.Unmarshal(lines[0], &header); err != nil {
+		t.Fatalf("header line: %v", err)
+	}
+	if header.SearchParams.SearchedFiles != 2 || header.SearchParams.MatchedFiles != 1 {
+		t.Errorf("unexpected search params: %+v", header.SearchParams)
+	}
+
+	// Rate lines spliced with commas must form a valid JSON array.
+	spliced := append([]byte("["), bytes.Join(lines[1:], []byte(","))...)
+	spliced = append(spliced, ']')
+	var rates []mrf.RateResult
+	if err := json.Unmarshal(spliced, &rates); err != nil {
+		t.Fatalf("spliced rates: %v", err)
+	}
+	if len(rates) != 2 || rates[0].BillingCodeDescription != "line one\nline two" {
+		t.Errorf("unexpected rates: %+v", rates)
+	}
+}
+
+func TestWriteResultsJSONL_NoResults(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "results.jsonl")
+
+	if err := WriteResultsJSONL(path, mrf.SearchParams{SearchedFiles: 1}, nil); err != nil {
+		t.Fatalf("WriteResultsJSONL failed: %v", err)
+	}
+	data, err := os.ReadFile(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if n := bytes.Count(data, []byte("\n")); n != 1 {
+		t.Errorf("expected only the header line, got %d lines", n)
+	}
+}
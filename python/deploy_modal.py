@@ -7,10 +7,16 @@ Usage:
     modal run python/deploy_modal.py --npi 1770671182 --urls-file ny_urls.txt
 """
 
+import contextlib
+import heapq
+import io
 import json
 import os
 import sys
 import time
+import uuid
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
 import modal
@@ -44,23 +50,50 @@ def _cli_arg(name, default, type_fn=str):
 
 _MEMORY = _cli_arg("memory", 4096, int)
 _CPU = _cli_arg("cpu", 2, int)
-_WORKERS = 1
-_SHARDS = 100
+# One file worker per allocated CPU; 0 on the command line means the same.
+_WORKERS = _CPU
+_SHARDS = 400
+# Don't split lists so finely that containers spend more time starting than searching.
+_MIN_URLS_PER_SHARD = 16
+# Crash tolerance comes from per-call retries; extra replicas are opt-in and
+# only help tail latency.
+_REPLICAS = 1
+_RETRIES = 2
+
+# Cache of URL -> Content-Length used for size-aware sharding.
+SIZE_CACHE_PATH = ".url_sizes.json"
+
+# Shards are micro-batches pushed through a bounded pool of warm containers,
+# so container count is tuned separately from shard count.
+_CONCURRENCY = _cli_arg("concurrency", 20, int)
+_SCALEDOWN_WINDOW = 600
 
 _TIMEOUT = _cli_arg("timeout", 3600, int)
 _CLOUD = _cli_arg("cloud", "aws")
 _REGION = _cli_arg("region", "us-east-1")
 
+# Reducer runs on a single container that splices shard files together in parallel.
+_REDUCE_CPU = 8
+_REDUCE_MEMORY = 8192
+
+# Shared volume where shards leave their results for the reducer.
+VOLUME_NAME = "npi-rates-data"
+DATA_DIR = "/data"
+# Read size used when streaming shard files.
+_CHUNK_SIZE = 1 << 20
+# Present in a run's directory while the run accepts shard results.
+RUN_MARKER = ".active"
+
 # ---------------------------------------------------------------------------
 # Modal app setup
 # ---------------------------------------------------------------------------
 app = modal.App("npi-rates")
 
-image = (
-    modal.Image.from_dockerfile("Dockerfile")
-    .run_commands("apk add --no-cache python3")
-    .dockerfile_commands(["ENTRYPOINT []"])
-)
+# python3 is installed in the Dockerfile's runtime stage so it is part of a
+# cached layer rather than a separate build step on top of it.
+image = modal.Image.from_dockerfile("Dockerfile").dockerfile_commands(["ENTRYPOINT []"])
+
+volume = modal.Volume.from_name(VOLUME_NAME, create_if_missing=True)
 
 
 @app.function(
@@ -70,9 +103,16 @@ image = (
     timeout=_TIMEOUT,
     cloud=_CLOUD,
     region=_REGION,
+    volumes={DATA_DIR: volume},
+    max_containers=_CONCURRENCY,
+    scaledown_window=_SCALEDOWN_WINDOW,
+    retries=_RETRIES,
 )
-def run_search(shard_index: int, urls: list[str], npi: str, workers: int):
+def run_search(
+    shard_index: int, replica: int, urls: list[str], npi: str, workers: int, run_id: str
+):
     import os
+    import shutil
     import subprocess as sp
 
     work_dir = f"/tmp/shard-{shard_index}"
@@ -83,7 +123,9 @@ def run_search(shard_index: int, urls: list[str], npi: str, workers: int):
     with open(urls_path, "w") as f:
         f.write("\n".join(urls))
 
-    output_path = os.path.join(work_dir, "results.json")
+    # Write results to local disk; the volume is network-backed, so it only
+    # receives one sequential copy of the finished file below.
+    output_path = os.path.join(work_dir, "results.jsonl")
 
     proc = sp.run(
         [
@@ -94,15 +136,32 @@ def run_search(shard_index: int, urls: list[str], npi: str, workers: int):
             "--log-progress",
             "--stream",
             "--tmp-dir", tmp_dir,
+            "--format", "jsonl",
             "-o", output_path,
         ],
     )
 
-    if proc.returncode != 0:
-        raise RuntimeError(f"Shard {shard_index} failed with exit code {proc.returncode}")
+    try:
+        if proc.returncode != 0:
+            raise RuntimeError(f"Shard {shard_index} failed with exit code {proc.returncode}")
+
+        # A replica that outlives its run must not recreate files that
+        # cleanup has already removed.
+        volume.reload()
+        if not os.path.exists(os.path.join(DATA_DIR, run_id, RUN_MARKER)):
+            return shard_index, None
 
-    with open(output_path, "rb") as f:
-        return f.read()
+        # Only the path travels back; the reducer reads the file from the volume.
+        result_dir = os.path.join(DATA_DIR, run_id, f"shard-{shard_index}")
+        os.makedirs(result_dir, exist_ok=True)
+        result_path = os.path.join(result_dir, f"replica-{replica}.jsonl")
+        shutil.copyfile(output_path, result_path)
+        volume.commit()
+    finally:
+        # Containers are reused across shards; don't let scratch accumulate.
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return shard_index, result_path
 
 
 def read_urls(path: str) -> list[str]:
@@ -116,88 +175,346 @@ def read_urls(path: str) -> list[str]:
     return urls
 
 
-def shard_urls(urls: list[str], n: int) -> list[list[str]]:
-    """Split URLs into n roughly-equal shards via round-robin."""
+def _head_size(url: str) -> tuple[int | None, bool]:
+    """HEAD a URL and return (size, definitive).
+
+    Only a 2xx with a Content-Length or a 4xx is definitive; timeouts,
+    network errors, 5xx and malformed responses may succeed on a later run.
+    """
+    import http.client
+    import urllib.error
+    import urllib.request
+
+    req = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(req, timeout=15) as resp:
+            length = resp.headers.get("Content-Length")
+            if length:
+                return int(length), True
+            return None, False
+    except urllib.error.HTTPError as e:
+        return None, 400 <= e.code < 500
+    except (OSError, ValueError, http.client.HTTPException):
+        return None, False
+
+
+def fetch_sizes(urls: list[str], cache_path: str = SIZE_CACHE_PATH) -> dict[str, int]:
+    """Look up file sizes for URLs via parallel HEAD requests, cached on disk.
+
+    URLs whose size could not be determined are omitted from the result.
+    Definitive failures (4xx) are cached as null so they are not probed
+    again; transient failures are retried on the next run.
+    """
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    missing = [u for u in urls if u not in cache]
+    if missing:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            for url, (size, definitive) in zip(missing, pool.map(_head_size, missing)):
+                if definitive:
+                    cache[url] = size
+        try:
+            with open(cache_path, "w") as f:
+                json.dump(cache, f)
+        except OSError as e:
+            log(f"Could not write size cache {cache_path}: {e}")
+
+    return {u: cache[u] for u in urls if cache.get(u) is not None}
+
+
+def effective_shards(n_urls: int, shards: int, min_urls_per_shard: int) -> int:
+    """Cap the shard count so each shard gets at least min_urls_per_shard URLs."""
+    return min(shards, max(1, n_urls // max(1, min_urls_per_shard)))
+
+
+def shard_urls(urls: list[str], n: int, sizes: dict[str, int] | None = None) -> list[list[str]]:
+    """Split URLs into at most n shards.
+
+    When sizes are known, shards are balanced by total bytes using
+    longest-processing-time-first bin packing; URLs with unknown size are
+    weighted by the mean known size. Without sizes, URLs are dealt round-robin.
+    """
     shards: list[list[str]] = [[] for _ in range(n)]
-    for i, url in enumerate(urls):
-        shards[i % n].append(url)
+    if not sizes:
+        for i, url in enumerate(urls):
+            shards[i % n].append(url)
+        return [s for s in shards if s]
+
+    default = sum(sizes.values()) // len(sizes)
+
+    def weight(url: str) -> int:
+        return sizes.get(url, default)
+
+    loads = [(0, i) for i in range(n)]
+    for url in sorted(urls, key=weight, reverse=True):
+        load, i = heapq.heappop(loads)
+        shards[i].append(url)
+        heapq.heappush(loads, (load + weight(url), i))
     return [s for s in shards if s]
 
 
-def merge_results(shard_outputs: list[bytes]) -> dict:
-    """Merge shard results into a single SearchOutput."""
-    all_results = []
-    total_searched = 0
-    total_matched = 0
-    total_duration = 0.0
-    npis = []
-
-    for data in shard_outputs:
-        output = json.loads(data)
-        params = output.get("search_params", {})
-        total_searched += params.get("searched_files", 0)
-        total_matched += params.get("matched_files", 0)
-        total_duration = max(total_duration, params.get("duration_seconds", 0))
-        if not npis:
-            npis = params.get("npis", [])
-        all_results.extend(output.get("results", []))
-
-    return {
-        "search_params": {
-            "npis": npis,
-            "searched_files": total_searched,
-            "matched_files": total_matched,
-            "duration_seconds": total_duration,
-        },
-        "results": all_results,
+def read_shard_params(path: str) -> tuple[dict, int]:
+    """Decode only the search_params header line of a shard's JSONL file.
+
+    Returns the params and the byte offset where the rate lines begin.
+    """
+    with open(path, "rb") as f:
+        params = json.loads(f.readline())["search_params"]
+        return params, f.tell()
+
+
+def compress_shard(path: str, body_start: int, last: bool, segment_path: str) -> int:
+    """Write a shard's rate lines as one compressed segment of the results array.
+
+    Runs in a worker process and writes straight to segment_path, so no
+    result bytes cross the process boundary. Newlines become commas; for the
+    last non-empty shard the trailing comma is dropped so the array closes
+    cleanly. Returns the number of rates.
+    """
+    compressor = zlib.compressobj(1)
+    count = 0
+    held = b""
+    with open(path, "rb") as f, open(segment_path, "wb") as out:
+        f.seek(body_start)
+        while chunk := f.read(_CHUNK_SIZE):
+            count += chunk.count(b"\n")
+            chunk = held + chunk.replace(b"\n", b",")
+            out.write(compressor.compress(chunk[:-1]))
+            held = chunk[-1:]
+        if not last:
+            out.write(compressor.compress(held))
+        out.write(compressor.flush())
+    return count
+
+
+@app.function(
+    image=image,
+    cpu=_REDUCE_CPU,
+    memory=_REDUCE_MEMORY,
+    timeout=_TIMEOUT,
+    cloud=_CLOUD,
+    region=_REGION,
+    volumes={DATA_DIR: volume},
+)
+def reduce_shards(run_id: str, paths: list[str], duration_seconds: float):
+    """Turn shard JSONL files on the volume into compressed results segments.
+
+    Only each shard's header line is decoded. Each non-empty shard's rate
+    lines are converted and compressed by a worker process into its own
+    zlib segment file next to the shard files, so the splice and the
+    compression both run in parallel and no result bytes pass through this
+    process or the return value. Returns (search_params, result_count,
+    segments), where segments are volume paths that decompress, in order,
+    to the contents of the merged results array.
+    """
+    volume.reload()
+
+    params = {
+        "npis": [],
+        "searched_files": 0,
+        "matched_files": 0,
+        "duration_seconds": duration_seconds,
     }
+    bodies = []
+    for path in paths:
+        shard_params, body_start = read_shard_params(path)
+        params["searched_files"] += shard_params.get("searched_files", 0)
+        params["matched_files"] += shard_params.get("matched_files", 0)
+        if not params["npis"]:
+            params["npis"] = shard_params.get("npis") or []
+        if os.path.getsize(path) > body_start:
+            bodies.append((path, body_start))
+
+    run_dir = os.path.join(DATA_DIR, run_id)
+    segments = [f"/{run_id}/seg-{i:05d}.z" for i in range(len(bodies))]
+
+    # os.cpu_count() reports the host's cores, not the container's reservation.
+    with ProcessPoolExecutor(max_workers=min(_REDUCE_CPU, len(bodies) or 1)) as pool:
+        count = sum(pool.map(
+            compress_shard,
+            [path for path, _ in bodies],
+            [start for _, start in bodies],
+            [i == len(bodies) - 1 for i in range(len(bodies))],
+            [os.path.join(run_dir, os.path.basename(s)) for s in segments],
+        ))
+    volume.commit()
+
+    return params, count, segments
+
+
+def results_header(params: dict) -> bytes:
+    """Return the merged document up to the opening of the results array."""
+    return (
+        b'{"search_params":'
+        + json.dumps(params, separators=(",", ":")).encode()
+        + b',"results":['
+    )
+
+
+async def read_segment(segment: str):
+    """Yield the decompressed bytes of one results segment from the volume."""
+    decompressor = zlib.decompressobj()
+    async for chunk in volume.read_file.aio(segment):
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+async def write_output(path: str, params: dict, segments: list[str], pretty: bool):
+    """Stream the reducer's compressed segments down from the volume into path.
+
+    With pretty, each segment (one shard's rates) is decoded and re-indented
+    on its own, so memory stays bounded by the largest shard rather than the
+    whole merged document.
+    """
+    with open(path, "wb") as f:
+        if not pretty:
+            f.write(results_header(params))
+            for segment in segments:
+                async for data in read_segment(segment):
+                    f.write(data)
+            f.write(b"]}")
+            return
+
+        # orjson is only needed locally, and only for --pretty.
+        import orjson
+
+        def indented(obj, prefix: bytes) -> bytes:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).replace(b"\n", b"\n" + prefix)
+
+        f.write(b'{\n  "search_params": ' + indented(params, b"  ") + b',\n  "results": [')
+        sep = b"\n    "
+        for segment in segments:
+            body = b"".join([data async for data in read_segment(segment)])
+            for rate in orjson.loads(b"[" + body.rstrip(b",") + b"]"):
+                f.write(sep + indented(rate, b"    "))
+                sep = b",\n    "
+            del body
+        f.write(b"\n  ]\n}\n" if sep != b"\n    " else b"]\n}\n")
+
+
+async def mark_run_active(run_id: str):
+    """Create the run's directory on the volume, holding the active marker."""
+    async with volume.batch_upload() as batch:
+        batch.put_file(io.BytesIO(b""), f"/{run_id}/{RUN_MARKER}")
+
+
+async def cleanup_run(run_id: str):
+    """Remove a run's shard files from the shared volume."""
+    try:
+        await volume.remove_file.aio(f"/{run_id}", recursive=True)
+    except Exception as e:
+        log(f"Could not clean up volume files for run {run_id}: {e}")
 
 
 @app.local_entrypoint()
-def main(
+async def main(
     npi: str,
     urls_file: str = None,
     shards: int = _SHARDS,
     workers: int = _WORKERS,
+    replicas: int = _REPLICAS,
+    min_urls_per_shard: int = _MIN_URLS_PER_SHARD,
     output: str = "",
+    pretty: bool = False,
+    concurrency: int = _CONCURRENCY,
 ):
+    # `concurrency` is read from sys.argv at import time (see _CONCURRENCY)
+    # because max_containers is fixed at decorator time; it is declared here
+    # so the Modal CLI accepts the flag.
     if workers == 0:
         workers = _CPU
 
     urls = read_urls(urls_file)
-    url_shards = shard_urls(urls, shards)
+    effective = effective_shards(len(urls), shards, min_urls_per_shard)
+    if effective < shards:
+        log(f"Shards: capped at {effective} (at least {min_urls_per_shard} URLs per shard)")
+    # Sizes only matter when there is more than one shard to balance.
+    sizes = fetch_sizes(urls) if effective > 1 else {}
+    url_shards = shard_urls(urls, effective, sizes)
+    run_id = uuid.uuid4().hex[:12]
 
     log(f"NPI: {npi}")
     log(f"Files: {len(urls)} URLs across {len(url_shards)} shards")
-    log(f"Infra: {_CPU} CPU, {_MEMORY} MB memory, {_CLOUD}/{_REGION}")
-    log(f"Workers per shard: {workers}")
-
+    if sizes:
+        total_gb = sum(sizes.values()) / 1e9
+        log(f"Sizes: {len(sizes)}/{len(urls)} known ({total_gb:.1f} GB), sharded by size")
+    elif effective > 1:
+        log("Sizes: unknown, sharded round-robin")
+    log(f"Infra: {_CPU} CPU, {_MEMORY} MB memory, {_CLOUD}/{_REGION}, up to {_CONCURRENCY} containers")
+    log(f"Workers per shard: {workers}, replicas per shard: {replicas}")
+    log(f"Run ID: {run_id}")
+
+    await mark_run_active(run_id)
     start = time.time()
 
+    # Each shard runs as `replicas` independent calls. The first replica to
+    # succeed supplies the shard's results file, so a shard only fails if
+    # every one of its replicas does. Once every shard has a result the map
+    # is closed explicitly, cancelling outstanding replicas before cleanup;
+    # any that still finish see the run marker gone and skip their write.
+    # Shards leave their results on the volume and return only the path.
+    calls = [
+        (i, r, shard, npi, workers, run_id)
+        for i, shard in enumerate(url_shards)
+        for r in range(replicas)
+    ]
+    paths: dict[int, str] = {}
     try:
-        shard_outputs = list(run_search.starmap(
-            [(i, shard, npi, workers) for i, shard in enumerate(url_shards)]
-        ))
+        async with contextlib.aclosing(
+            run_search.starmap.aio(calls, return_exceptions=True, order_outputs=False)
+        ) as shard_outs:
+            async for shard_out in shard_outs:
+                if isinstance(shard_out, BaseException):
+                    log(f"Shard replica failed: {shard_out}")
+                    continue
+                shard_index, path = shard_out
+                if path is None:
+                    continue
+                paths.setdefault(shard_index, path)
+                if len(paths) == len(url_shards):
+                    break
     except Exception as e:
         log(f"Search failed: {e}")
+        await cleanup_run(run_id)
+        sys.exit(1)
+
+    failed = len(url_shards) - len(paths)
+    if failed:
+        log(f"Search failed: {failed} shard(s) failed on all {replicas} replicas")
+        await cleanup_run(run_id)
         sys.exit(1)
 
     wall_time = time.time() - start
 
-    merged = merge_results(shard_outputs)
-    merged["search_params"]["duration_seconds"] = wall_time
+    # Merge in the cloud next to the volume and download one file.
+    log(f"Merging {len(paths)} shards...")
+    try:
+        params, count, segments = await reduce_shards.remote.aio(
+            run_id, [paths[i] for i in sorted(paths)], wall_time
+        )
+    except Exception as e:
+        log(f"Merge failed: {e}")
+        await cleanup_run(run_id)
+        sys.exit(1)
 
     if output:
         output_path = output
     else:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = f"results_{timestamp}.json"
-    with open(output_path, "w") as f:
-        json.dump(merged, f, indent=2)
+    # The segments live in the run's directory, so clean up only after the
+    # download has finished.
+    try:
+        await write_output(output_path, params, segments, pretty)
+    finally:
+        await cleanup_run(run_id)
 
-    count = len(merged["results"])
-    searched = merged["search_params"]["searched_files"]
-    matched = merged["search_params"]["matched_files"]
+    searched = params["searched_files"]
+    matched = params["matched_files"]
     log(f"Search complete: {searched} files searched, {matched} matched, {count} rates found in {wall_time:.1f}s")
     log(f"Results saved to {output_path}")
     log("Function run completed")
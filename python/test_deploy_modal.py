@@ -0,0 +1,127 @@
+"""Tests for the local helpers in deploy_modal.py.
+
+modal is stubbed out so the module can be imported without it installed.
+"""
+
+import json
+import os
+import sys
+import types
+import zlib
+
+import pytest
+
+
+class _Stub:
+    """Stands in for modal: decorators pass functions through, everything else is a stub."""
+
+    def __getattr__(self, name):
+        return _Stub()
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return _Stub()
+
+
+sys.modules.setdefault("modal", _Stub())
+sys.path.insert(0, os.path.dirname(__file__))
+
+import deploy_modal  # noqa: E402
+
+
+def write_shard(path, rates, matched=1):
+    with open(path, "w") as f:
+        params = {"npis": [1], "searched_files": 2, "matched_files": matched, "duration_seconds": 1}
+        f.write(json.dumps({"search_params": params}) + "\n")
+        for rate in rates:
+            f.write(json.dumps(rate) + "\n")
+    return str(path)
+
+
+def rates(shard, n):
+    return [{"source_file": f"f{shard}", "npi": 1, "note": "a\nb", "k": k} for k in range(n)]
+
+
+def splice(tmp_path, shards):
+    """Compress each non-empty shard like reduce_shards and join the segments into a document."""
+    bodies = []
+    for i, shard in enumerate(shards):
+        path = write_shard(tmp_path / f"shard-{i}.jsonl", shard)
+        _, body_start = deploy_modal.read_shard_params(path)
+        if body_start < os.path.getsize(path):
+            bodies.append((path, body_start))
+    out = b""
+    total = 0
+    for i, (path, body_start) in enumerate(bodies):
+        segment = str(tmp_path / f"seg-{i}.z")
+        total += deploy_modal.compress_shard(path, body_start, i == len(bodies) - 1, segment)
+        with open(segment, "rb") as f:
+            out += zlib.decompress(f.read())
+    doc = json.loads(deploy_modal.results_header({}) + out + b"]}")
+    return doc["results"], total
+
+
+@pytest.mark.parametrize("chunk_size", [1 << 20, 1, 7])
+def test_compress_shard_splices_valid_json(tmp_path, monkeypatch, chunk_size):
+    monkeypatch.setattr(deploy_modal, "_CHUNK_SIZE", chunk_size)
+    shards = [rates(0, 3), rates(1, 5), rates(2, 1)]
+    results, total = splice(tmp_path, shards)
+    assert results == [r for shard in shards for r in shard]
+    assert total == 9
+
+
+def test_compress_shard_drops_comma_after_last_nonempty_shard(tmp_path):
+    shards = [rates(0, 2), rates(1, 3), [], []]
+    results, total = splice(tmp_path, shards)
+    assert results == shards[0] + shards[1]
+    assert total == 5
+
+
+def test_compress_shard_skips_empty_shards(tmp_path):
+    shards = [[], rates(1, 2), [], rates(3, 1)]
+    results, total = splice(tmp_path, shards)
+    assert results == shards[1] + shards[3]
+    assert total == 3
+
+
+def test_compress_shard_all_empty(tmp_path):
+    assert splice(tmp_path, [[], []]) == ([], 0)
+
+
+def test_shard_urls_packs_largest_first():
+    sizes = {"a": 100, "b": 60, "c": 50, "d": 40, "e": 10}
+    shards = shard_loads(deploy_modal.shard_urls(list(sizes), 2, sizes), sizes)
+    assert sorted(shards) == [120, 140]
+
+
+def test_shard_urls_unknown_sizes_round_robin():
+    urls = [f"u{i}" for i in range(7)]
+    shards = deploy_modal.shard_urls(urls, 3)
+    assert shards == [["u0", "u3", "u6"], ["u1", "u4"], ["u2", "u5"]]
+
+
+def test_shard_urls_covers_every_url_once():
+    urls = [f"u{i}" for i in range(50)]
+    sizes = {u: (i * 37) % 11 for i, u in enumerate(urls)}
+    shards = deploy_modal.shard_urls(urls, 8, sizes)
+    assert sorted(u for shard in shards for u in shard) == sorted(urls)
+
+
+@pytest.mark.parametrize(
+    "n_urls,shards,min_urls,expected",
+    [
+        (1000, 400, 16, 62),
+        (1007, 400, 16, 62),
+        (10, 400, 16, 1),
+        (0, 400, 16, 1),
+        (100_000, 400, 16, 400),
+        (100, 400, 1, 100),
+    ],
+)
+def test_effective_shards_caps_by_min_urls(n_urls, shards, min_urls, expected):
+    assert deploy_modal.effective_shards(n_urls, shards, min_urls) == expected
+
+
+def shard_loads(shards, sizes):
+    return [sum(sizes[u] for u in shard) for shard in shards]